@@ -5,85 +5,257 @@ Extract training data from your codebase for LoRA fine-tuning.
 Usage:
     python scripts/extract_training_data.py /path/to/codebase
     python scripts/extract_training_data.py .  # Current directory
+    pypy3 scripts/extract_training_data.py .   # Faster on large codebases
+
+Only the standard library is required, so the script runs unchanged under
+PyPy, whose JIT speeds up the per-file scanning loops. orjson is used for
+output when installed (CPython only) and otherwise falls back to json.
 
 This creates:
     - training_data.jsonl: Training examples in chat format
-    - validation_data.jsonl: 10% held out for validation
+    - validation_data.jsonl: ~10% held out for validation
+    - training_data_with_meta.jsonl: All examples with _meta, for review
 """
 
+import codecs
+import hashlib
 import os
 import sys
 import json
 import random
 import re
-from pathlib import Path
-from typing import List, Dict, Optional
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the stdlib encoder produces the same output
+    orjson = None
 
 # Configuration
 EXTENSIONS = {'.js', '.jsx', '.ts', '.tsx', '.java'}
 SKIP_DIRS = {'node_modules', '.git', 'dist', 'build', '__pycache__', '.next', 'coverage', '.cache'}
 MIN_FILE_SIZE = 100  # bytes
 MAX_FILE_SIZE = 50000  # bytes - skip huge files
-MAX_CONTENT_LENGTH = 3000  # chars per example
+MAX_CONTENT_LENGTH = 3000  # bytes per example
+MAX_FUNCTIONS_PER_FILE = 5
+VALIDATION_FRACTION = 0.1  # share of examples held out for validation
+MIN_VALIDATION_EXAMPLES = 10
+SPLIT_SEED = None  # set to an int for a reproducible train/val split
+WRITE_BUFFER_SIZE = 1 << 20  # bytes buffered per output file between writes
+SNIFF_SIZE = 4096  # bytes checked for binary/non-UTF-8 content before a full read
+PROCESS_CHUNK_SIZE = 32  # files per worker task
+MAX_CHUNKS_IN_FLIGHT = (os.cpu_count() or 1) * 4  # bounds results held in memory
+
+# Patterns are compiled once at import rather than looked up per call. They
+# are bytes patterns: files are scanned undecoded and only the snippets kept
+# in examples are decoded to str.
+_DOC_RE = re.compile(rb'/\*\*\s*([\s\S]*?)\*/')
+# Function/method openers, matched up to and including the body's opening brace.
+# The body itself is found by _find_braced_blocks, which balances braces in a
+# single linear pass instead of backtracking through `[^}]+`. JS/TS function
+# declarations and arrow functions share one alternation so each file is
+# scanned once; each alternative is a named group identifying its kind.
+_JS_FUNC_RE = re.compile(
+    rb'(?P<decl>(?:export\s+)?(?:async\s+)?function\s+\w+\s*\([^)]*\)\s*(?::\s*[^{]+)?\s*\{)'
+    rb'|(?P<arrow>(?:export\s+)?const\s+\w+\s*=\s*(?:async\s+)?\([^)]*\)\s*(?::\s*[^=]+)?\s*=>\s*\{)',
+    re.MULTILINE
+)
+_JAVA_METHOD_RE = re.compile(
+    rb'(?P<method>(?:public|private|protected)\s+(?:static\s+)?(?:\w+\s+)+\w+\s*\([^)]*\)\s*(?:throws\s+[\w,\s]+)?\s*\{)',
+    re.MULTILINE
+)
+# Braces plus the tokens that may contain braces without opening a block
+_BRACE_TOKEN_RE = re.compile(
+    rb'[{}]'
+    rb'|"(?:\\.|[^"\\\n])*"'
+    rb"|'(?:\\.|[^'\\\n])*'"
+    rb'|`(?:\\.|[^`\\])*`'
+    rb'|//[^\n]*'
+    rb'|/\*[\s\S]*?\*/'
+)
+# Openers and brace tokens in one automaton, so a file is tokenized in a
+# single pass no matter how deeply its functions nest. Openers are listed
+# first so they win over the `{` they end with.
+_JS_SCAN_RE = re.compile(_JS_FUNC_RE.pattern + b'|' + _BRACE_TOKEN_RE.pattern, re.MULTILINE)
+_JAVA_SCAN_RE = re.compile(_JAVA_METHOD_RE.pattern + b'|' + _BRACE_TOKEN_RE.pattern, re.MULTILINE)
+_JS_SIG_RE = re.compile(rb'((?:export\s+)?(?:async\s+)?(?:function\s+\w+|const\s+\w+\s*=)[^{]*)')
+_JAVA_SIG_RE = re.compile(rb'((?:public|private|protected)[^{]*)')
+_WHITESPACE = b' \t\n\r\x0b\x0c'  # what bytes.strip() removes
+
+_LANGUAGE_BY_SUFFIX = {
+    '.js': 'javascript',
+    '.jsx': 'javascript',
+    '.ts': 'typescript',
+    '.tsx': 'typescript',
+    '.java': 'java'
+}
+
+# Prompt scaffolding is fixed per language, so it's built once up front
+_LANGUAGES = ('javascript', 'typescript', 'java', 'code')
+_EXPLAIN_PREFIX = {lang: f"Explain what this {lang} code does:\n\n```{lang}\n" for lang in _LANGUAGES}
+_COMPLETE_PREFIX = {lang: f"Complete this {lang} code:\n\n```{lang}\n" for lang in _LANGUAGES}
+_IMPLEMENT_PROMPT = {lang: f"Implement this {lang} function" for lang in _LANGUAGES}
+_FENCE_OPEN = {lang: f"```{lang}\n" for lang in _LANGUAGES}
+_FENCE_CLOSE = "\n```"
+
+# JSONL records are assembled from these and separately serialized values
+_MESSAGES_KEY = b'{"messages":'
+_META_KEY = b',"_meta":'
+
+
+class CodeFile(NamedTuple):
+    """A code file selected for extraction."""
+    path: str  # relative to the codebase root
+    content: bytes
+    language: str
+    size: int
+
+
+class CodeFunction(NamedTuple):
+    """A function/method body found in a code file."""
+    code: memoryview
+    language: str
+
+
+def _looks_like_text(head: bytes, decoder: codecs.IncrementalDecoder) -> bool:
+    """Check that the first block of a file is UTF-8 text (no NULs, decodes cleanly)."""
+    if b'\x00' in head:
+        return False
+    try:
+        # final=False tolerates a multi-byte character cut off at the end
+        decoder.decode(head, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _code_digest(code) -> bytes:
+    """Short content hash of the part of a function body that ends up in an example."""
+    return hashlib.blake2b(memoryview(code)[:MAX_CONTENT_LENGTH], digest_size=8).digest()
+
+
+def _dumps(obj) -> bytes:
+    """Serialize obj as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _decode(data) -> str:
+    """Decode a retained snippet, replacing any invalid bytes inside it."""
+    return str(data, 'utf-8', 'replace')
+
+
+def _clip(data, start: int = 0, end: Optional[int] = None) -> str:
+    """Decode at most MAX_CONTENT_LENGTH bytes of data[start:end] without copying first."""
+    view = memoryview(data)
+    if end is None:
+        end = len(view)
+    end = min(end, start + MAX_CONTENT_LENGTH)
+    # If the cut lands inside a multi-byte character, drop that partial
+    # character rather than letting it decode to U+FFFD. Step back over
+    # continuation bytes (0b10xxxxxx, at most 3) to the character's lead byte.
+    if end < len(view):
+        lead = end
+        while lead > start and end - lead < 3 and view[lead] & 0xC0 == 0x80:
+            lead -= 1
+        if lead < end and view[lead] >= 0xC0:
+            end = lead
+    return _decode(view[start:end])
 
 
 def get_language(suffix: str) -> str:
     """Map file extension to language name."""
-    return {
-        '.js': 'javascript',
-        '.jsx': 'javascript',
-        '.ts': 'typescript',
-        '.tsx': 'typescript',
-        '.java': 'java'
-    }.get(suffix, 'code')
+    return _LANGUAGE_BY_SUFFIX.get(suffix, 'code')
 
 
-def extract_docstring(content: str, language: str) -> Optional[str]:
+def extract_docstring(content: bytes, language: str) -> Optional[str]:
     """Extract the first docstring/comment block from code."""
-    if language in ('javascript', 'typescript'):
-        # JSDoc style
-        match = re.search(r'/\*\*\s*([\s\S]*?)\*/', content)
-        if match:
-            return match.group(1).strip()
-    elif language == 'java':
-        # Javadoc style
-        match = re.search(r'/\*\*\s*([\s\S]*?)\*/', content)
-        if match:
-            return match.group(1).strip()
+    # JSDoc and Javadoc share the same /** ... */ block syntax
+    if language in ('javascript', 'typescript', 'java'):
+        if (match := _DOC_RE.search(content)):
+            return _decode(match.group(1).strip())
     return None
 
 
-def extract_functions(content: str, language: str) -> List[Dict]:
+def _find_braced_blocks(content: bytes, start_re: re.Pattern, scan_re: re.Pattern) -> Iterator[memoryview]:
+    """Yield each block opened by start_re, through its matching brace.
+
+    Between blocks only start_re is searched for; inside them scan_re tracks
+    openers, braces, strings and comments together, so nested functions are
+    found in the same pass as their enclosing block's braces. Blocks of the
+    same kind (the opener's group name) don't nest, so a function's inner
+    arrow functions are still found but its inner function declarations are
+    not. Blocks are yielded in order of where they start.
+    """
+    view = memoryview(content)
+    pos = 0
+    depth = 0
+    open_blocks = []  # (kind, [start, end], depth) for blocks awaiting their close
+    open_kinds = set()
+    pending = deque()  # [start, end] in start order; end is None until closed
+    while (token := (scan_re if open_blocks else start_re).search(content, pos)):
+        pos = token.end()
+        kind = token.lastgroup
+        if kind is not None:
+            depth += 1
+            if kind not in open_kinds:
+                block = [token.start(), None]
+                pending.append(block)
+                open_blocks.append((kind, block, depth))
+                open_kinds.add(kind)
+        elif token.group() == b'{':
+            depth += 1
+        elif token.group() == b'}':
+            if open_blocks[-1][2] == depth:
+                kind, block, _ = open_blocks.pop()
+                open_kinds.discard(kind)
+                block[1] = pos
+                # An outer block holds back the ones nested in it until it closes
+                while pending and pending[0][1] is not None:
+                    start, end = pending.popleft()
+                    yield view[start:end]
+            depth -= 1
+
+    # Blocks left unclosed at end of file are dropped, but not the closed
+    # ones they were holding back
+    for start, end in pending:
+        if end is not None:
+            yield view[start:end]
+
+
+def extract_functions(content: bytes, language: str) -> List[CodeFunction]:
     """Extract individual functions/methods from code."""
-    functions = []
-
     if language in ('javascript', 'typescript'):
         # Match function declarations, arrow functions, methods
-        patterns = [
-            r'((?:export\s+)?(?:async\s+)?function\s+\w+\s*\([^)]*\)\s*(?::\s*[^{]+)?\s*\{[^}]+\})',
-            r'((?:export\s+)?const\s+\w+\s*=\s*(?:async\s+)?\([^)]*\)\s*(?::\s*[^=]+)?\s*=>\s*\{[^}]+\})',
-        ]
-        for pattern in patterns:
-            matches = re.findall(pattern, content, re.MULTILINE)
-            functions.extend([{'code': m, 'language': language} for m in matches if len(m) > 50])
-
+        start_re, scan_re = _JS_FUNC_RE, _JS_SCAN_RE
     elif language == 'java':
         # Match method declarations
-        pattern = r'((?:public|private|protected)\s+(?:static\s+)?(?:\w+\s+)+\w+\s*\([^)]*\)\s*(?:throws\s+[\w,\s]+)?\s*\{[^}]+\})'
-        matches = re.findall(pattern, content, re.MULTILINE)
-        functions.extend([{'code': m, 'language': language} for m in matches if len(m) > 50])
+        start_re, scan_re = _JAVA_METHOD_RE, _JAVA_SCAN_RE
+    else:
+        return []
 
-    return functions[:5]  # Limit per file
+    # Blocks are found lazily, so stopping at the limit skips the rest of the file
+    functions = []
+    for code in _find_braced_blocks(content, start_re, scan_re):
+        if len(code) <= 50:
+            continue
+        functions.append(CodeFunction(code, language))
+        if len(functions) == MAX_FUNCTIONS_PER_FILE:
+            break
+    return functions
 
 
-def create_explanation_example(code: str, language: str, filepath: str) -> Dict:
+def create_explanation_example(code: bytes, language: str, filepath: str) -> Dict:
     """Create a 'explain this code' training example."""
-    truncated = code[:MAX_CONTENT_LENGTH]
     return {
         "messages": [
             {
                 "role": "user",
-                "content": f"Explain what this {language} code does:\n\n```{language}\n{truncated}\n```"
+                "content": _EXPLAIN_PREFIX[language] + _clip(code) + _FENCE_CLOSE
             },
             {
                 "role": "assistant",
@@ -94,54 +266,64 @@ def create_explanation_example(code: str, language: str, filepath: str) -> Dict:
     }
 
 
-def create_completion_example(code: str, language: str) -> Optional[Dict]:
+def create_completion_example(code: bytes, language: str) -> Optional[Dict]:
     """Create a code completion training example."""
     if len(code) < 200:
         return None
 
     # Find a good split point (end of a line in the middle-ish)
     mid = len(code) // 2
-    split = code.rfind('\n', mid - 200, mid + 200)
+    split = code.rfind(b'\n', mid - 200, mid + 200)
     if split == -1:
+        # No line break nearby; split at the middle byte, but not inside a
+        # multi-byte character (skip back over continuation bytes)
         split = mid
-
-    prefix = code[:split].rstrip()
-    suffix = code[split:].lstrip()
-
-    if len(prefix) < 50 or len(suffix) < 50:
+        while split > 0 and code[split] & 0xC0 == 0x80:
+            split -= 1
+
+    # Trim whitespace around the split by index, so the prefix and suffix
+    # are only materialized once, as truncated strings
+    prefix_end = split
+    while prefix_end > 0 and code[prefix_end - 1] in _WHITESPACE:
+        prefix_end -= 1
+    suffix_start = split
+    while suffix_start < len(code) and code[suffix_start] in _WHITESPACE:
+        suffix_start += 1
+
+    if prefix_end < 50 or len(code) - suffix_start < 50:
         return None
 
     return {
         "messages": [
             {
                 "role": "user",
-                "content": f"Complete this {language} code:\n\n```{language}\n{prefix[:MAX_CONTENT_LENGTH]}\n```"
+                "content": _COMPLETE_PREFIX[language] + _clip(code, 0, prefix_end) + _FENCE_CLOSE
             },
             {
                 "role": "assistant",
-                "content": f"```{language}\n{suffix[:MAX_CONTENT_LENGTH]}\n```"
+                "content": _FENCE_OPEN[language] + _clip(code, suffix_start) + _FENCE_CLOSE
             }
         ],
         "_meta": {"type": "completion", "needs_completion": False}
     }
 
 
-def create_function_example(func: Dict, filepath: str) -> Dict:
+def create_function_example(func: CodeFunction, filepath: str) -> Dict:
     """Create a 'write this function' training example."""
-    code = func['code']
-    language = func['language']
+    code = func.code
+    language = func.language
 
     # Try to extract the function signature
     if language in ('javascript', 'typescript'):
-        sig_match = re.match(r'((?:export\s+)?(?:async\s+)?(?:function\s+\w+|const\s+\w+\s*=)[^{]*)', code)
+        sig_match = _JS_SIG_RE.match(code)
     else:
-        sig_match = re.match(r'((?:public|private|protected)[^{]*)', code)
+        sig_match = _JAVA_SIG_RE.match(code)
 
     if sig_match:
-        signature = sig_match.group(1).strip()
+        signature = _decode(sig_match.group(1).strip())
         description = f"Implement a function with this signature: `{signature}`"
     else:
-        description = f"Implement this {language} function"
+        description = _IMPLEMENT_PROMPT[language]
 
     return {
         "messages": [
@@ -151,73 +333,119 @@ def create_function_example(func: Dict, filepath: str) -> Dict:
             },
             {
                 "role": "assistant",
-                "content": f"```{language}\n{code[:MAX_CONTENT_LENGTH]}\n```"
+                "content": _FENCE_OPEN[language] + _clip(code) + _FENCE_CLOSE
             }
         ],
         "_meta": {"type": "implementation", "file": filepath, "needs_completion": False}
     }
 
 
-def extract_code_files(root_dir: str) -> List[Dict]:
-    """Extract all relevant code files from directory."""
-    files = []
-    root_path = Path(root_dir).resolve()
+def iter_code_entries(root_dir: str) -> Iterator[Tuple[str, int]]:
+    """Yield (path, size) for candidate code files under root_dir, without reading them."""
+    # os.scandir lets us prune skipped directories (node_modules etc.) before
+    # descending into them, and check extensions without building Path objects.
+    # Size is checked here from the entry's own stat, so out-of-range files are
+    # never opened.
+    try:
+        it = os.scandir(root_dir)
+    except OSError as e:
+        print(f"  Skipping {root_dir}: {e}")
+        return
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    yield from iter_code_entries(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                name = entry.name
+                dot = name.rfind('.')
+                if dot < 0 or name[dot:] not in EXTENSIONS:
+                    continue
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+                if MIN_FILE_SIZE <= size <= MAX_FILE_SIZE:
+                    yield entry.path, size
+
+
+def load_code_file(path: str, size: int, root_dir: str) -> Optional[CodeFile]:
+    """Read a code file, or return None if it is unreadable."""
+    try:
+        # Kept as bytes; scanning doesn't need the decoded text. Binary files
+        # are caught early by sniffing the first block; the rest is then run
+        # through the same decoder only to reject non-UTF-8 files.
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        with open(path, 'rb') as fh:
+            head = fh.read(SNIFF_SIZE)
+            if not _looks_like_text(head, decoder):
+                print(f"  Skipping {path}: not UTF-8 text")
+                return None
+            rest = fh.read()
+        decoder.decode(rest, final=True)  # Raises UnicodeDecodeError, reported below
+        content = head + rest
+        rel_path = os.path.relpath(path, root_dir)
+        language = get_language(os.path.splitext(path)[1])
+
+        return CodeFile(rel_path, content, language, size)
+    except Exception as e:
+        print(f"  Skipping {path}: {e}")
+        return None
 
-    for path in root_path.rglob('*'):
-        # Skip excluded directories
-        if any(skip in path.parts for skip in SKIP_DIRS):
-            continue
 
-        # Check extension
-        if path.suffix not in EXTENSIONS or not path.is_file():
-            continue
+def file_training_examples(file: CodeFile) -> Iterator[Tuple[Dict, Optional[bytes]]]:
+    """Yield (example, dedup key) pairs from a single code file.
 
-        # Check size
-        try:
-            size = path.stat().st_size
-            if size < MIN_FILE_SIZE or size > MAX_FILE_SIZE:
-                continue
+    The key is set for function examples only, so main can drop duplicate
+    function bodies across files.
+    """
+    content = file.content
+    language = file.language
+    filepath = file.path
 
-            content = path.read_text(encoding='utf-8')
-            rel_path = str(path.relative_to(root_path))
-            language = get_language(path.suffix)
+    # Type 1: Full file explanation (for smaller files)
+    if len(content) < 2000:
+        yield create_explanation_example(content, language, filepath), None
 
-            files.append({
-                'path': rel_path,
-                'content': content,
-                'language': language,
-                'size': size
-            })
-        except Exception as e:
-            print(f"  Skipping {path}: {e}")
+    # Type 2: Code completion
+    completion = create_completion_example(content, language)
+    if completion:
+        yield completion, None
 
-    return files
+    # Type 3: Individual function implementations
+    functions = extract_functions(content, language)
+    for func in functions:
+        yield create_function_example(func, filepath), _code_digest(func.code)
 
 
-def generate_training_examples(files: List[Dict]) -> List[Dict]:
-    """Generate diverse training examples from code files."""
-    examples = []
+def process_code_file(entry: Tuple[str, int], root_dir: str) -> Optional[Tuple[str, List[Tuple[Dict, Optional[bytes]]]]]:
+    """Worker entry point: read one (path, size) file and return (language, keyed examples)."""
+    file = load_code_file(*entry, root_dir)
+    if not file:
+        return None
+    return file.language, list(file_training_examples(file))
 
-    for file in files:
-        content = file['content']
-        language = file['language']
-        filepath = file['path']
 
-        # Type 1: Full file explanation (for smaller files)
-        if len(content) < 2000:
-            examples.append(create_explanation_example(content, language, filepath))
+def _process_chunk(entries: List[Tuple[str, int]], root_dir: str) -> list:
+    """Worker entry point: process_code_file over a chunk of entries."""
+    return [process_code_file(entry, root_dir) for entry in entries]
 
-        # Type 2: Code completion
-        completion = create_completion_example(content, language)
-        if completion:
-            examples.append(completion)
 
-        # Type 3: Individual function implementations
-        functions = extract_functions(content, language)
-        for func in functions:
-            examples.append(create_function_example(func, filepath))
+def iter_processed_files(pool: ProcessPoolExecutor, entries: Iterable[Tuple[str, int]], root_dir: str) -> Iterator:
+    """Yield process_code_file results in walk order, computed on the pool.
 
-    return examples
+    Unlike Executor.map, which submits everything up front and lets finished
+    results pile up, at most MAX_CHUNKS_IN_FLIGHT chunks of PROCESS_CHUNK_SIZE
+    files are submitted or waiting to be consumed at any time.
+    """
+    entries = iter(entries)
+    in_flight = deque()
+    while (chunk := list(islice(entries, PROCESS_CHUNK_SIZE))):
+        if len(in_flight) >= MAX_CHUNKS_IN_FLIGHT:
+            yield from in_flight.popleft().result()
+        in_flight.append(pool.submit(_process_chunk, chunk, root_dir))
+    while in_flight:
+        yield from in_flight.popleft().result()
 
 
 def main():
@@ -236,34 +464,94 @@ def main():
     print(f"Looking for: {', '.join(EXTENSIONS)}")
     print()
 
-    # Extract files
-    files = extract_code_files(root_dir)
-    print(f"Found {len(files)} code files")
+    # Files are read and scanned in parallel worker processes; their examples
+    # are streamed straight to disk and stats are tallied along the way.
+    root_dir = os.path.abspath(root_dir)
+    by_lang = Counter()
+    by_type = Counter()
+    needs_completion = 0
+    train_count = 0
+    val_count = 0
+
+    # Each example is assigned to train/val by an independent draw. A small
+    # reservoir of train examples is held back (unwritten) so that short runs
+    # can still be topped up to MIN_VALIDATION_EXAMPLES at the end.
+    rng = random.Random(SPLIT_SEED)
+    held = []
+
+    # Function bodies already emitted, by _code_digest; copy-pasted and
+    # generated boilerplate otherwise shows up once per copy
+    seen_functions = set()
+    duplicates = 0
+
+    # Large write buffers batch many JSONL lines into each underlying write
+    with open("training_data_with_meta.jsonl", 'wb', buffering=WRITE_BUFFER_SIZE) as f_meta, \
+            open("training_data.jsonl", 'wb', buffering=WRITE_BUFFER_SIZE) as f_train, \
+            open("validation_data.jsonl", 'wb', buffering=WRITE_BUFFER_SIZE) as f_val, \
+            ProcessPoolExecutor() as pool:
+        for result in iter_processed_files(pool, iter_code_entries(root_dir), root_dir):
+            if result is None:
+                continue
+            lang, examples = result
+            by_lang[lang] += 1
+
+            for ex, key in examples:
+                if key is not None:
+                    if key in seen_functions:
+                        duplicates += 1
+                        continue
+                    seen_functions.add(key)
+
+                # Every example is built with both keys, so read them directly
+                messages, meta = ex["messages"], ex["_meta"]
+                by_type[meta["type"]] += 1
+                if meta["needs_completion"]:
+                    needs_completion += 1
+
+                # The messages are serialized once and shared by both lines:
+                # with _meta for review, and without it (it's just for our
+                # tracking) for training
+                record = _MESSAGES_KEY + _dumps(messages)
+                f_meta.write(record + _META_KEY + _dumps(meta) + b'}\n')
+                cleaned = record + b'}\n'
+
+                # Hold out roughly VALIDATION_FRACTION for validation
+                if rng.random() < VALIDATION_FRACTION:
+                    f_val.write(cleaned)
+                    val_count += 1
+                    continue
+
+                train_count += 1
+                if len(held) < MIN_VALIDATION_EXAMPLES:
+                    held.append(cleaned)
+                    continue
+                slot = rng.randrange(train_count)
+                if slot < MIN_VALIDATION_EXAMPLES:
+                    held[slot], cleaned = cleaned, held[slot]
+                f_train.write(cleaned)
+
+        rng.shuffle(held)
+        shortfall = max(0, MIN_VALIDATION_EXAMPLES - val_count)
+        for i, cleaned in enumerate(held):
+            if i < shortfall:
+                f_val.write(cleaned)
+                val_count += 1
+                train_count -= 1
+            else:
+                f_train.write(cleaned)
+
+    print(f"Found {sum(by_lang.values())} code files")
 
     # Show breakdown by language
-    by_lang = {}
-    for f in files:
-        lang = f['language']
-        by_lang[lang] = by_lang.get(lang, 0) + 1
     for lang, count in sorted(by_lang.items()):
         print(f"  {lang}: {count} files")
     print()
 
-    # Generate examples
-    examples = generate_training_examples(files)
-    print(f"Generated {len(examples)} training examples")
-
-    # Count by type
-    by_type = {}
-    needs_completion = 0
-    for ex in examples:
-        t = ex.get('_meta', {}).get('type', 'unknown')
-        by_type[t] = by_type.get(t, 0) + 1
-        if ex.get('_meta', {}).get('needs_completion'):
-            needs_completion += 1
-
+    print(f"Generated {train_count + val_count} training examples")
     for t, count in sorted(by_type.items()):
         print(f"  {t}: {count} examples")
+    if duplicates > 0:
+        print(f"  (skipped {duplicates} duplicate functions)")
     print()
 
     if needs_completion > 0:
@@ -271,34 +559,8 @@ def main():
         print("      (marked with 'needs_completion: True' in _meta)")
         print()
 
-    # Shuffle
-    random.shuffle(examples)
-
-    # Split into train/val
-    val_size = max(10, len(examples) // 10)
-    val_examples = examples[:val_size]
-    train_examples = examples[val_size:]
-
-    # Remove _meta before saving (it's just for our tracking)
-    def clean(ex):
-        return {"messages": ex["messages"]}
-
-    # Save training data
-    with open("training_data.jsonl", 'w') as f:
-        for ex in train_examples:
-            f.write(json.dumps(clean(ex)) + '\n')
-    print(f"Saved {len(train_examples)} training examples to training_data.jsonl")
-
-    # Save validation data
-    with open("validation_data.jsonl", 'w') as f:
-        for ex in val_examples:
-            f.write(json.dumps(clean(ex)) + '\n')
-    print(f"Saved {len(val_examples)} validation examples to validation_data.jsonl")
-
-    # Also save with metadata for review
-    with open("training_data_with_meta.jsonl", 'w') as f:
-        for ex in examples:
-            f.write(json.dumps(ex) + '\n')
+    print(f"Saved {train_count} training examples to training_data.jsonl")
+    print(f"Saved {val_count} validation examples to validation_data.jsonl")
     print(f"Saved full data with metadata to training_data_with_meta.jsonl")
 
     print()